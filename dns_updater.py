@@ -11,28 +11,175 @@ Copyright (c) 2024 eduardo911
 
 This software is provided "as is", without warranty of any kind, express or implied, including but not limited to the warranties of merchantability, fitness for a particular purpose, and noninfringement. See the LICENSE file for details.
 """
+import argparse
+import atexit
 import os
+import queue
+import signal
+import sys
 import time
+import asyncio
 import datetime
-import requests
+import email.utils
+import math
+import orjson
+import httpx
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from urllib.parse import urlparse  # Correct import
 
 # Configure Logging
 LOG_FILE = "dns_updater.log"
 
-# Ensure the log file exists
-if not os.path.exists(LOG_FILE):
-    with open(LOG_FILE, "w") as f:
-        pass  # Create an empty file
+# Log records are queued in memory and written to the file by a background
+# thread, so logging never blocks on disk I/O. The handler creates the file if
+# needed and appends to it otherwise, but only once something is logged.
+_file_handler = logging.FileHandler(LOG_FILE, delay=True)
+_file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
 
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, _file_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-logging.info("DNS Updater started.")
+_queue_handler = QueueHandler(_log_queue)
+logging.getLogger().addHandler(_queue_handler)
+logging.getLogger().setLevel(logging.INFO)
+
+# httpx logs every request at INFO; keep only its warnings and errors
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Cloudflare credentials, read once at startup and checked by main()
+API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
+ZONE_ID = os.getenv("CLOUDFLARE_ZONE_ID")
+
+# Headers sent with every Cloudflare API call (not with the public trace endpoint)
+HEADERS = {
+    "Authorization": f"Bearer {API_TOKEN}",
+    "Content-Type": "application/json"
+}
+
+# Base URL of the Cloudflare API
+CLOUDFLARE_API_URL = "https://api.cloudflare.com/client/v4"
+
+# Seconds between two DNS synchronizations in daemon mode
+UPDATE_INTERVAL = 30 * 60
+
+# Retry policy for transient Cloudflare API failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_RETRY_DELAY = 60
+
+# IP address the DNS records were last successfully synchronized to
+_last_ip = None
+
+# ETag and body of the last DNS records listing, used for conditional requests
+_last_etag = None
+_last_records_json = None
+
+
+def create_client():
+    """
+    Creates the HTTP client shared by all Cloudflare API calls.
+
+    The client keeps connections alive between requests and uses HTTP/2, so
+    concurrent requests are multiplexed over a single TLS connection. Failed
+    connection attempts are retried by the transport. The client carries no
+    credentials; API calls pass HEADERS explicitly.
+
+    Returns:
+        httpx.AsyncClient: The configured client.
+    """
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    )
+    return httpx.AsyncClient(transport=transport, follow_redirects=True)
+
+
+def _retry_delay(response, attempt):
+    """
+    Returns the number of seconds to wait before retrying a request.
+
+    The Retry-After header is honored when present, either as a number of seconds
+    or as an HTTP date, and capped at MAX_RETRY_DELAY seconds. A missing,
+    malformed, negative or non-finite value falls back to an exponential
+    backoff.
+
+    Args:
+        response (httpx.Response): The response that triggered the retry.
+        attempt (int): The zero-based number of the failed attempt.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    delay = None
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                retry_at = None
+            if retry_at is not None:
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+                now = datetime.datetime.now(datetime.timezone.utc)
+                delay = max(0.0, (retry_at - now).total_seconds())
+
+    if delay is None or not math.isfinite(delay) or delay < 0:
+        return RETRY_BACKOFF * 2 ** attempt
+    return min(delay, MAX_RETRY_DELAY)
+
+
+def _next_retry_delay(response, attempt, retries=MAX_RETRIES):
+    """
+    Decides whether a response should be retried.
+
+    Args:
+        response (httpx.Response): The response received.
+        attempt (int): The zero-based number of the attempt that got the response.
+        retries (int): The number of retries allowed for the request.
+
+    Returns:
+        float: The delay in seconds before the next attempt, or None if the
+        response is final.
+    """
+    if response.status_code not in RETRY_STATUSES or attempt >= retries:
+        return None
+    return _retry_delay(response, attempt)
+
+
+async def _request(client, method, url, **kwargs):
+    """
+    Sends a request, retrying idempotent calls on transient status codes.
+
+    GET and PUT requests answered with a 429 or 5xx status code are retried up to
+    MAX_RETRIES times, waiting as long as the Retry-After header asks or with an
+    exponential backoff otherwise.
+
+    Args:
+        client (httpx.AsyncClient): The client used to send the request.
+        method (str): The HTTP method.
+        url (str): The URL to request.
+        **kwargs: Extra arguments passed to httpx.AsyncClient.request.
+
+    Returns:
+        httpx.Response: The last response received.
+    """
+    retries = MAX_RETRIES if method in ("GET", "PUT") else 0
+    attempt = 0
+    while True:
+        response = await client.request(method, url, **kwargs)
+        delay = _next_retry_delay(response, attempt, retries)
+        if delay is None:
+            return response
+        await asyncio.sleep(delay)
+        attempt += 1
 
 
 def validate_https_url(url):
@@ -50,48 +197,71 @@ def validate_https_url(url):
         raise ValueError("The URL must use an encrypted protocol (HTTPS).")
 
 
-def get_all_dns_records():
+validate_https_url(CLOUDFLARE_API_URL)
+
+
+async def get_all_dns_records(client):
     """
     Fetches all DNS records from Cloudflare using the API.
 
+    When a previous listing provided an ETag, the request is made conditional and
+    the last listing is returned if Cloudflare answers 304 Not Modified. The
+    listing is deliberately not reused without this revalidation: it is only
+    fetched right before records are written, and a stale copy would leave
+    records added in the dashboard on the old IP address.
+
+    Args:
+        client (httpx.AsyncClient): The client used to call the API.
+
     Returns:
         dict: The JSON response containing DNS records.
 
     Raises:
-        ValueError: If the API token or Zone ID is not set in the environment variables.
         Exception: If the API call fails (non-200 status code).
     """
-    CLOUD_API_TOKEN_ERROR = "Cloudflare API token not set in environment variables."
-    CLOUD_ZONE_ID_ERROR = "Cloudflare Zone ID not set in environment variables."
+    global _last_etag, _last_records_json
 
-    api_token = os.getenv("CLOUDFLARE_API_TOKEN")
-    if not api_token:
-        raise ValueError(CLOUD_API_TOKEN_ERROR)
+    url = f"{CLOUDFLARE_API_URL}/zones/{ZONE_ID}/dns_records"
 
-    zone_id = os.getenv("CLOUDFLARE_ZONE_ID")
-    if not zone_id:
-        raise ValueError(CLOUD_ZONE_ID_ERROR)
+    headers = dict(HEADERS)
+    if _last_etag:
+        headers["If-None-Match"] = _last_etag
 
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
-    validate_https_url(url)
+    response = await _request(client, "GET", url, headers=headers)
+    if response.status_code == 304:
+        logging.info("DNS Records not modified since last fetch.")
+        return _last_records_json
 
-    headers = {
-        "Authorization": f"Bearer {api_token}",
-        "Content-Type": "application/json"
-    }
-
-    response = requests.get(url, headers=headers)
     if response.status_code != 200:
         raise Exception(f"Failed to fetch DNS records: {response.status_code} - {response.text}")
 
     logging.info("DNS Records fetched successfully.")
-    return response.json()
+    _last_records_json = orjson.loads(response.content)
+    _last_etag = response.headers.get("ETag")
+    return _last_records_json
+
+
+def _forget_records():
+    """
+    Drops the last DNS records listing and its ETag, so the next fetch downloads
+    a fresh listing.
+    """
+    global _last_etag, _last_records_json
 
+    _last_etag = None
+    _last_records_json = None
 
-def get_current_ip():
+
+async def get_current_ip(client):
     """
     Retrieves the current public IP address of the machine.
 
+    The trace response is streamed and reading stops at the "ip=" line. Like the
+    API calls, the request is retried on a 429 or 5xx status code.
+
+    Args:
+        client (httpx.AsyncClient): The client used to call the trace endpoint.
+
     Returns:
         str: The public IP address.
 
@@ -100,110 +270,290 @@ def get_current_ip():
     """
     url = "https://cloudflare.com/cdn-cgi/trace/"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        for line in response.text.splitlines():
-            if line.startswith("ip="):
-                ip_address = line.split("=")[1]
-                logging.info(f"Current IP address: {ip_address}")
-                return ip_address
-        raise ValueError("IP address not found in response")
+        attempt = 0
+        while True:
+            async with client.stream("GET", url) as response:
+                delay = _next_retry_delay(response, attempt)
+                if delay is None:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        line = line.strip()
+                        if line.startswith("ip="):
+                            ip_address = line[3:]
+                            logging.info("Current IP address: %s", ip_address)
+                            return ip_address
+                    raise ValueError("IP address not found in response")
+            await asyncio.sleep(delay)
+            attempt += 1
     except Exception as e:
-        logging.error(f"Failed to fetch current IP address: {e}")
+        logging.error("Failed to fetch current IP address: %s", e)
         raise
 
 
-def update_dns_records(records, ip_address):
+async def _put_record(client, base_url, record, ip_address):
+    """
+    Sends a single DNS record update to the Cloudflare API.
+
+    Args:
+        client (httpx.AsyncClient): The client used to send the request.
+        base_url (str): The DNS records URL of the zone, ending with a slash.
+        record (dict): The DNS record as returned by Cloudflare.
+        ip_address (str): The new IP address for the record.
+
+    Returns:
+        httpx.Response: The response of the update call.
+    """
+    update_url = base_url + record['id']
+
+    data = {
+        "type": record['type'],
+        "name": record['name'],
+        "content": ip_address,
+        "ttl": record['ttl'],
+        "proxied": record['proxied']
+    }
+
+    return await _request(client, "PUT", update_url, headers=HEADERS, content=orjson.dumps(data))
+
+
+async def _put_records(client, base_url, records, ip_address):
+    """
+    Updates DNS records one by one, sending the requests concurrently.
+
+    Args:
+        client (httpx.AsyncClient): The client used to send the requests.
+        base_url (str): The DNS records URL of the zone, ending with a slash.
+        records (list): The DNS records to update.
+        ip_address (str): The new IP address for the records.
+
+    Returns:
+        bool: True if every record was updated successfully.
+    """
+    responses = await asyncio.gather(
+        *[_put_record(client, base_url, record, ip_address) for record in records],
+        return_exceptions=True,
+    )
+
+    success = True
+    for record, response in zip(records, responses):
+        record_name = record['name']
+        if isinstance(response, httpx.HTTPError):
+            logging.error("Failed to update record %s: %s", record_name, response)
+            success = False
+        elif isinstance(response, BaseException):
+            raise response
+        elif response.status_code != 200:
+            logging.error("Failed to update record %s: %s - %s", record_name, response.status_code, response.text)
+            success = False
+        else:
+            logging.info("Successfully updated record %s to IP %s.", record_name, ip_address)
+            record['content'] = ip_address
+
+    return success
+
+
+async def _patch_records_batch(client, base_url, records, ip_address):
+    """
+    Updates DNS records in a single call to the Cloudflare batch endpoint.
+
+    Args:
+        client (httpx.AsyncClient): The client used to send the request.
+        base_url (str): The DNS records URL of the zone, ending with a slash.
+        records (list): The DNS records to update.
+        ip_address (str): The new IP address for the records.
+
+    Returns:
+        httpx.Response: The response of the batch call.
+    """
+    patches = [{"id": record['id'], "content": ip_address} for record in records]
+    return await _request(
+        client, "POST", base_url + "batch", headers=HEADERS, content=orjson.dumps({"patches": patches})
+    )
+
+
+async def update_dns_records(client, records, ip_address):
     """
     Updates DNS records to the specified IP address using the Cloudflare API.
 
+    All updates are sent in a single batch call. If the batch call is rejected
+    (4xx status code other than 429 Too Many Requests), the records are updated
+    one by one instead, concurrently over the shared client. Records that
+    already point to the given IP address are skipped, and updated records are
+    changed in place so the listing kept for conditional requests stays
+    accurate.
+
     Args:
+        client (httpx.AsyncClient): The client used to call the API.
         records (dict): The DNS records fetched from Cloudflare.
         ip_address (str): The new IP address to update the DNS records with.
 
+    Returns:
+        bool: True if every A/AAAA record now points to the IP address.
+
     Raises:
-        ValueError: If the Cloudflare API token is not set.
         Exception: If the API call to update records fails.
     """
-    CLOUD_API_TOKEN_ERROR = "Cloudflare API token not set in environment variables."
-    api_token = os.getenv("CLOUDFLARE_API_TOKEN")
-    if not api_token:
-        raise ValueError(CLOUD_API_TOKEN_ERROR)
+    base_url = f"{CLOUDFLARE_API_URL}/zones/{ZONE_ID}/dns_records/"
 
-    headers = {
-        "Authorization": f"Bearer {api_token}",
-        "Content-Type": "application/json"
-    }
+    targets = []
+    for record in [r for r in records.get('result', []) if r['type'] in ('A', 'AAAA')]:
+        if record.get('content') == ip_address:
+            logging.debug("Skipping record %s, already set to IP %s.", record['name'], ip_address)
+            continue
+        targets.append(record)
+
+    if not targets:
+        return True
+
+    response = await _patch_records_batch(client, base_url, targets, ip_address)
+    if response.status_code == 200:
+        for record in targets:
+            logging.info("Successfully updated record %s to IP %s.", record['name'], ip_address)
+            record['content'] = ip_address
+        return True
+
+    # A rate-limited batch is not retried as N individual PUTs
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        logging.warning(
+            "Batch update rejected: %s - %s. Updating records one by one.", response.status_code, response.text
+        )
+        return await _put_records(client, base_url, targets, ip_address)
+
+    logging.error("Failed to batch update records: %s - %s", response.status_code, response.text)
+    return False
+
+
+async def sync_dns_records(client):
+    """
+    Points the DNS records to the current public IP address.
 
-    for record in records.get('result', []):
-        if record['type'] in ('A', 'AAAA'):
-            record_id = record['id']
-            record_name = record['name']
-            update_url = f"https://api.cloudflare.com/client/v4/zones/{os.getenv('CLOUDFLARE_ZONE_ID')}/dns_records/{record_id}"
+    The DNS records are only fetched and updated when the IP address changed since
+    the last successful synchronization. When an update fails, the last records
+    listing and its ETag are dropped so the next attempt works on fresh records.
 
-            data = {
-                "type": record['type'],
-                "name": record_name,
-                "content": ip_address,
-                "ttl": record['ttl'],
-                "proxied": record['proxied']
-            }
+    Args:
+        client (httpx.AsyncClient): The client used to call the API.
+
+    Returns:
+        bool: True if the DNS records point to the current IP address.
+    """
+    global _last_ip
 
-            response = requests.put(update_url, headers=headers, json=data)
-            if response.status_code != 200:
-                logging.error(f"Failed to update record {record_name}: {response.status_code} - {response.text}")
-            else:
-                logging.info(f"Successfully updated record {record_name} to IP {ip_address}.")
+    ip_address = await get_current_ip(client)
+    if ip_address == _last_ip:
+        logging.info("IP address unchanged (%s), skipping DNS update.", ip_address)
+        return True
 
+    records = await get_all_dns_records(client)
+    if not await update_dns_records(client, records, ip_address):
+        _forget_records()
+        return False
 
-def run_loop_for_30_days():
+    _last_ip = ip_address
+    return True
+
+
+async def _wait_for_any(deadline, *events):
     """
-    Runs a loop for 30 days to fetch, update, and synchronize DNS records.
+    Waits until the given monotonic deadline or until one of the events is set.
+
+    Args:
+        deadline (float): The time.monotonic() value to wait for.
+        *events (asyncio.Event): Events interrupting the wait.
+    """
+    waiters = [asyncio.create_task(event.wait()) for event in events]
+    try:
+        await asyncio.wait(waiters, timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
 
-    The function periodically checks the current IP address, retrieves the DNS
-    records from Cloudflare, and updates them if necessary. It performs checks every
-    30 minutes and logs all activities.
 
-    Logs:
-        Records the start and end times, and any errors encountered during the process.
+async def run_forever(client):
     """
-    start_time = datetime.datetime.now()
-    end_time = start_time + datetime.timedelta(days=30)
+    Synchronizes the DNS records every UPDATE_INTERVAL seconds until stopped.
+
+    SIGTERM and SIGINT stop the loop cleanly. SIGHUP forgets the last synchronized
+    IP address and records listing, and forces an immediate update.
+
+    Args:
+        client (httpx.AsyncClient): The client used to call the API.
+    """
+    global _last_ip
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    reload = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, reload.set)
 
-    while datetime.datetime.now() < end_time:
+    next_tick = time.monotonic()
+    while not stop.is_set():
         try:
-            ip_address = get_current_ip()
-            records = get_all_dns_records()
-            update_dns_records(records, ip_address)  # Call the function to update records
+            await sync_dns_records(client)
         except Exception as error:
-            logging.error(f"Error during execution: {error}")
+            logging.error("Error during execution: %s", error)
 
-        # Countdown timer for 30 minutes (displaying every 30 seconds)
-        for i in range(30 * 60, 0, -30):
-            print(f"Next update in {i // 60} minutes {i % 60} seconds...", end="\r")
-            time.sleep(30)  # Sleep for 30 seconds
-        print("")  # Clear the timer display
+        # Ticks are scheduled from the start time so the interval does not drift
+        next_tick += UPDATE_INTERVAL
+        await _wait_for_any(next_tick, stop, reload)
 
+        if reload.is_set():
+            reload.clear()
+            logging.info("SIGHUP received, forcing a DNS update.")
+            _last_ip = None
+            _forget_records()
+            next_tick = time.monotonic()
 
-if __name__ == "__main__":
-    while True:
-        run_loop_for_30_days()
+    logging.info("DNS Updater stopped.")
+
+
+async def main(daemon=False):
+    """
+    Synchronizes the DNS records once, or continuously in daemon mode.
 
-        while True:  # Keep asking until valid input is received
-            user_input = input("The 30-day loop has completed. Do you want to restart? (yes/no): ").strip().lower()
+    By default the script is meant to be started periodically by a scheduler
+    (systemd timer, cron or a Kubernetes CronJob) rather than staying resident
+    between runs. In daemon mode it runs until stopped by a signal, under a
+    process supervisor such as Docker or systemd.
 
-            if user_input == 'no':
-                logging.info("User chose to exit. Stopping the loop.")
-                print("Exiting the loop.")
-                break  # Break inner loop
+    Args:
+        daemon (bool): Whether to keep running instead of synchronizing once.
 
-            elif user_input == 'yes':
-                logging.info("User chose to restart the loop.")
-                break  # Restart 30-day loop
+    Returns:
+        int: The process exit status, 0 when the DNS records are up to date.
+    """
+    logging.info("DNS Updater started.")
 
-            else:
-                print("Invalid input. Please enter 'yes' or 'no'.")
-                logging.warning("Invalid input received.")
+    if not API_TOKEN:
+        logging.error("Error during execution: Cloudflare API token not set in environment variables.")
+        return 1
+    if not ZONE_ID:
+        logging.error("Error during execution: Cloudflare Zone ID not set in environment variables.")
+        return 1
 
-        if user_input == 'no':  # Break outer loop and exit program
-            break
+    async with create_client() as client:
+        if daemon:
+            await run_forever(client)
+            return 0
+
+        try:
+            synced = await sync_dns_records(client)
+        except Exception as error:
+            logging.error("Error during execution: %s", error)
+            return 1
+
+    return 0 if synced else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update Cloudflare DNS records to the current public IP address.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and update the records every 30 minutes until stopped",
+    )
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(daemon=args.daemon)))